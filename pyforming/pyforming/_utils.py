@@ -0,0 +1,88 @@
+import numpy as np
+
+
+def complex_channel(h: np.ndarray, dtype: np.dtype = None):
+    """
+    Converts the channel matrix to the complex data type used for the
+    beamforming computation. Single precision channels are kept in single
+    precision (complex64), everything else is computed in complex128.
+
+    INPUT:
+    H       = Kr x Kt*Nt matrix with row index for users and column index
+            transmit antennas
+    dtype   = (Optional) complex data type overriding the one inferred from H
+
+    OUTPUT:
+    H       = Kr x Kt*Nt complex matrix
+    """
+    h = np.asarray(h)
+    if dtype is None:
+        dtype = np.result_type(h, np.complex64)
+
+    return np.asarray(h, dtype=dtype)
+
+
+def d_to_diag(d: np.ndarray, shape: tuple):
+    """
+    Converts the antenna selection to boolean masks with the diagonals of D.
+    D(:,:,k) is diagonal, so H*D(:,:,k) only masks the columns of H and the
+    diagonals are all that is needed. The boolean masks themselves are
+    accepted as well and are preferred, since they are much smaller than the
+    dense D. The form is told apart by the full shape and the data type,
+    since e.g. a Kr x Kt*Nt x Kt*Nt D and a stack of B x Kr x Kt*Nt masks
+    have the same shape when B = Kr = Kt*Nt.
+
+    INPUT:
+    D       = (... x) Kr x Kt*Nt x Kt*Nt array with the diagonal matrices
+            D(:,:,k), or (... x) Kr x Kt*Nt boolean array with their diagonals
+    shape   = shape of the channel H, which the masks must match
+
+    OUTPUT:
+    d_diag  = (... x) Kr x Kt*Nt boolean array. Element (k,j) is True if j:th
+            transmit antenna can transmit to user k
+    """
+    d = np.asarray(d)
+    shape = tuple(shape)
+    if d.shape == shape and d.dtype == np.bool_:
+        return d
+    elif d.shape == shape + shape[-1:]:
+        d_diag = np.diagonal(d, axis1=-2, axis2=-1)
+        # D is diagonal if all of its nonzero elements are on the diagonal
+        assert np.count_nonzero(d) == np.count_nonzero(d_diag), "D must be diagonal"
+    else:
+        raise ValueError(
+            f"D must have shape {shape + shape[-1:]}, or be a boolean mask of shape {shape}, "
+            f"for a channel of shape {shape}, got {d.dtype} array of shape {d.shape}"
+        )
+
+    mask = d_diag.astype(np.bool_)
+    assert np.count_nonzero(d_diag != mask) == 0, "D must have only zero or one entries"
+
+    return mask
+
+
+def normalize_beamforming(directions: np.ndarray):
+    """
+    Normalizes the beamforming directions of all users to unit 2-norm, like
+    in MATLAB, and arranges them as columns. The directions are normalized in
+    place, so only temporary arrays should be passed. Every resulting matrix
+    is Fortran ordered, so the beamforming vector of each user is contiguous
+    in memory. Leading dimensions, e.g. channel realizations, are kept.
+
+    INPUT:
+    directions  = (... x) Kr x Kt*Nt matrix with the beamforming direction of
+                user k in row k
+
+    OUTPUT:
+    w           = (... x) Kt*Nt x Kr Fortran ordered matrix with normalized
+                beamforming
+    """
+    directions = np.ascontiguousarray(directions)
+
+    # squared 2-norms of all rows in a single contraction
+    norms = np.sqrt(np.einsum("...kj,...kj->...k", directions, np.conj(directions)).real)
+    directions /= norms[..., np.newaxis]
+
+    # swapping the last two axes of a C ordered array leaves each
+    # Kt*Nt x Kr matrix Fortran ordered
+    return np.swapaxes(directions, -1, -2)
@@ -1,8 +1,8 @@
 import numpy as np
-import cvxpy
+from pyforming._utils import complex_channel, d_to_diag, normalize_beamforming
 
 
-def mrt(h: np.ndarray, d: np.ndarray = None):
+def mrt(h: np.ndarray, d: np.ndarray = None, dtype: np.dtype = None):
     """Calculates the maximum ratio transmission (MRT) beamforming vectors for a
     scenario where all or a subset of antennas transmit to each user.
 
@@ -18,41 +18,60 @@ def mrt(h: np.ndarray, d: np.ndarray = None):
     use this code for research that results in publications, please cite our
     original article listed above.
 
+    Leading dimensions of H, e.g. a batch of B channel realizations in a
+    Monte Carlo evaluation, are handled at once and kept in the output. D
+    then has the same leading dimensions.
+
     INPUT:
-    H  = Kr x Kt*Nt matrix with row index for users and column index
+    H  = (... x) Kr x Kt*Nt matrix with row index for users and column index
         transmit antennas
     D  = Kt*Nt x Kt*Nt x Kr diagonal matrix. Element (j,j,k) is one if j:th
-        transmit antenna can transmit to user k and zero otherwise
+        transmit antenna can transmit to user k and zero otherwise. A boolean
+        Kr x Kt*Nt matrix with the diagonals of D is accepted as well
+    dtype = (Optional) complex data type of the computation, complex64 for
+        single precision channels and complex128 otherwise
 
     OUTPUT:
-    wMRT = Kt*Nt x Kr matrix with normalized MRT beamforming
+    wMRT = (... x) Kt*Nt x Kr matrix with normalized MRT beamforming
     """
-    # number of users
-    kr = h.shape[0]
-
-    # total number of antennas
-    n = h.shape[-1]
+    h = complex_channel(h, dtype)
 
-    # if d matrix is not provided, all antennas can transmit to everyone
+    # Compute MRT, based on Definition 3.2 in optimal resource allocation
+    # Useful channels of all users at once, row k is (H(k,:)*D(:,:,k))'
     if d is None:
-        d = np.tile(np.eye(n), [kr, 1, 1])
+        # all antennas can transmit to everyone, D(:,:,k) is the identity
+        channel_vectors = np.conj(h)
+    else:
+        # D(:,:,k) is diagonal, so H(k,:)*D(:,:,k) only masks the entries of H(k,:)
+        channel_vectors = h * d_to_diag(d, h.shape)
+        np.conj(channel_vectors, out=channel_vectors)
 
-    # Pre-allocate an array for MRT beamforming
-    wMRT = np.zeros(np.transpose(h.shape), dtype=np.complex128)
-
-    # Compute MRT, based on Definition 3.2 in optimal resource allocation
-    for k in range(0, kr):
-        # Useful channel:
-        #   1) take all elements from h in row k, H(k,:)
-        #   2) multiply the result matrix with D(:,:,k)'
-        channel_vector = np.conj(np.transpose(np.matmul(h[k, :], d[k, :, :])))
-        # Normalization of useful channel
-        # use the 2-norm, like in MATLAB
-        wMRT[:, k] = channel_vector / np.linalg.norm(channel_vector, ord=2)
+    # Normalization of useful channels
+    # use the 2-norm, like in MATLAB
+    wMRT = normalize_beamforming(channel_vectors)
 
     return wMRT
 
 
+def mrt_batched(h: np.ndarray, d: np.ndarray = None, dtype: np.dtype = None):
+    """Calculates the maximum ratio transmission (MRT) beamforming vectors for
+    a batch of channel realizations at once, e.g. in a Monte Carlo evaluation.
+    Equivalent to mrt(), which handles the leading batch dimension itself.
+
+    INPUT:
+    H  = B x Kr x Kt*Nt array with the channel matrices of B realizations
+    D  = (Optional) B x Kr x Kt*Nt x Kt*Nt array with the diagonal antenna
+        selection matrices of every realization, or B x Kr x Kt*Nt boolean
+        array with their diagonals, see mrt()
+    dtype = (Optional) complex data type of the computation, complex64 for
+        single precision channels and complex128 otherwise
+
+    OUTPUT:
+    wMRT = B x Kt*Nt x Kr array with normalized MRT beamforming
+    """
+    return mrt(h, d, dtype)
+
+
 def test_mrt():
     """Used to debug only, a copy is available in pytest module"""
     H = np.transpose(
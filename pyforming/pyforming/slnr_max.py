@@ -1,11 +1,153 @@
 import numpy as np
-import cvxpy
-import logging
+from scipy.linalg.blas import get_blas_funcs
+from scipy.linalg.lapack import get_lapack_funcs
+from pyforming._utils import complex_channel, d_to_diag, normalize_beamforming
 
-logger = logging.getLogger("pyforming")
 
+def channel_gram(h: np.ndarray, dtype: np.dtype = None):
+    """
+    Calculates the Gram matrix H'*H shared by the SLNR-MAX systems of all
+    users. It depends only on the channel, so it can be computed once and
+    passed to slnr_max() when the same H is used with different eta or D.
+    Leading dimensions of H, e.g. channel realizations, are kept.
+
+    INPUT:
+    H       = (... x) Kr x Kt*Nt matrix with row index for users and column
+            index transmit antennas
+    dtype   = (Optional) complex data type of the computation, complex64 for
+            single precision channels and complex128 otherwise
+
+    OUTPUT:
+    gram    = (... x) Kt*Nt x Kt*Nt Hermitian matrix H'*H
+    """
+    h = complex_channel(h, dtype)
+
+    if h.ndim > 2:
+        # BLAS herk takes a single matrix, stacks use a batched product
+        return np.matmul(np.conj(np.swapaxes(h, -1, -2)), h)
+
+    # herk computes H'*H without materializing H' and fills only the upper
+    # triangle, the strictly lower one is mirrored from it. The BLAS routine
+    # matching the precision of H is used, i.e. cherk or zherk
+    (herk,) = get_blas_funcs(("herk",), (h,))
+    gram = herk(1.0, h, trans=2)
+    strictly_upper = np.triu(gram, 1)
+    gram += np.transpose(np.conj(strictly_upper, out=strictly_upper))
+
+    return gram
+
+
+def _solve_hermitian(a: np.ndarray, b: np.ndarray):
+    """
+    Solves a*x = b for Hermitian a, like MATLAB left division. A single system
+    is solved by Cholesky factorization with LAPACK posv, which reads only the
+    upper triangle. Systems that are not numerically positive definite, e.g.
+    due to a non-positive eta, are solved by LU factorization and singular ones
+    by least squares. Stacks of systems take the LU step for all of them in a
+    single batched call, which gives the same solutions.
+
+    INPUT:
+    a       = (... x) n x n Hermitian matrices
+    b       = (... x) n x m right-hand sides
+
+    OUTPUT:
+    x       = (... x) n x m solutions
+    """
+    if a.ndim == 2:
+        # The LAPACK routine matching the precision of a is used, i.e. cposv or zposv
+        (posv,) = get_lapack_funcs(("posv",), (a, b))
+        _, x, info = posv(a, b, lower=0)
+        if info == 0:
+            return x
+
+    try:
+        return np.linalg.solve(a, b)
+    except np.linalg.LinAlgError:
+        if a.ndim == 2:
+            x, _, _, _ = np.linalg.lstsq(a, b, rcond=None)
+            return x
+
+    # Solve the systems one at a time, only singular ones use least squares
+    b = np.broadcast_to(b, a.shape[:-2] + b.shape[-2:])
+    x = np.empty(b.shape, dtype=np.result_type(a, b))
+    for index in np.ndindex(a.shape[:-2]):
+        x[index] = _solve_hermitian(a[index], b[index])
+    return x
+
+
+def _signal_leakage_noise(gram: np.ndarray, eta: np.ndarray, d_diag: np.ndarray = None):
+    """
+    Builds the matrices I/eta(k) + D(:,:,k)*H'*H*D(:,:,k) of all users k from
+    the shared Gram matrix H'*H. Leading dimensions, e.g. channel
+    realizations, are kept.
+
+    INPUT:
+    gram    = (... x) Kt*Nt x Kt*Nt Gram matrix H'*H
+    eta     = (... x) Kr vector with SNR^(-1) like parameters
+    d_diag  = (Optional) (... x) Kr x Kt*Nt boolean matrix with the diagonals
+            of D, the identity if not provided
+
+    OUTPUT:
+    signal_leakage_noise = (... x) Kr x Kt*Nt x Kt*Nt matrices
+    """
+    if d_diag is None:
+        signal_leakage_noise = np.repeat(gram[..., np.newaxis, :, :], eta.shape[-1], axis=-3)
+    else:
+        # Mask rows and columns of the shared Gram matrix for every user
+        signal_leakage_noise = gram[..., np.newaxis, :, :] * d_diag[..., :, np.newaxis]
+        signal_leakage_noise *= d_diag[..., np.newaxis, :]
+
+    # Add I/eta(k) in place, only the diagonals change between users
+    antennas = np.arange(gram.shape[-1])
+    signal_leakage_noise[..., antennas, antennas] += 1 / eta[..., np.newaxis]
+
+    return signal_leakage_noise
 
-def slnr_max(h: np.ndarray, eta: np.ndarray = None, d: np.ndarray = None):
+
+def _solve_grouped_users(h: np.ndarray, gram: np.ndarray, eta: np.ndarray, d_diag: np.ndarray = None):
+    """
+    Solves the SLNR-MAX systems of users with the same antenna subset and eta
+    only once. Every distinct system is solved with the useful channels of
+    all users as right-hand side columns, and column k of the solution of the
+    system of user k is kept.
+
+    INPUT:
+    H       = Kr x Kt*Nt channel matrix
+    gram    = Kt*Nt x Kt*Nt Gram matrix H'*H
+    eta     = Kr vector with SNR^(-1) like parameters
+    d_diag  = (Optional) Kr x Kt*Nt boolean matrix with the diagonals of D,
+            the identity if not provided
+
+    OUTPUT:
+    projected_vectors = Kr x Kt*Nt matrix, row k is the unnormalized
+                      SLNR-MAX direction of user k
+    """
+    kr, n = h.shape
+
+    if d_diag is None:
+        user_systems = np.reshape(eta, (kr, 1))
+    else:
+        user_systems = np.column_stack((d_diag, eta))
+    systems, system_of_user = np.unique(user_systems, axis=0, return_inverse=True)
+
+    system_d_diag = None if d_diag is None else systems[:, :n].astype(np.bool_)
+    signal_leakage_noise = _signal_leakage_noise(gram, systems[:, -1], system_d_diag)
+    useful_channels = np.broadcast_to(np.conj(np.transpose(h)), (len(systems), n, kr))
+    if system_d_diag is not None:
+        useful_channels = useful_channels * system_d_diag[:, :, np.newaxis]
+
+    users = np.arange(kr)
+    return _solve_hermitian(signal_leakage_noise, useful_channels)[np.reshape(system_of_user, kr), :, users]
+
+
+def slnr_max(
+    h: np.ndarray,
+    eta: np.ndarray = None,
+    d: np.ndarray = None,
+    gram: np.ndarray = None,
+    dtype: np.dtype = None,
+    group_users: bool = False,
+):
     """
     Calculates the Signal-to-leakage-and-noise ratio maximizing (SLNR-MAX)
     beamforming for a scenario where all or a subset of antennas transmit
@@ -24,59 +166,117 @@ def slnr_max(h: np.ndarray, eta: np.ndarray = None, d: np.ndarray = None):
     use this code for research that results in publications, please cite our
     original article listed above.
 
+    Leading dimensions of H, e.g. a batch of B channel realizations in a
+    Monte Carlo evaluation, are handled at once and kept in the output. D and
+    gram then have the same leading dimensions.
+
     INPUT:
-    H       = Kr x Kt*Nt matrix with row index for users and column index
-            transmit antennas
-    eta     = Kr x 1 vector with SNR^(-1) like parameter of this user
+    H       = (... x) Kr x Kt*Nt matrix with row index for users and column
+            index transmit antennas
+    eta     = Kr x 1 vector with SNR^(-1) like parameter of this user. A Kr
+            vector is accepted as well, and both are shared by all leading
+            dimensions of H. A (... x) Kr array gives the parameters of
+            every realization, other shapes raise a ValueError
     D       = Kt*Nt x Kt*Nt x Kr diagonal matrix. Element (j,j,k) is one if j:th
-            transmit antenna can transmit to user k and zero otherwise
+            transmit antenna can transmit to user k and zero otherwise. A boolean
+            Kr x Kt*Nt matrix with the diagonals of D is accepted as well
+    gram    = (Optional) Kt*Nt x Kt*Nt Gram matrix H'*H from channel_gram(),
+            reused across calls with the same H
+    dtype   = (Optional) complex data type of the computation, complex64 for
+            single precision channels and complex128 otherwise
+    group_users = (Optional) solve the system of users with the same antenna
+            subset and eta only once. Finding those users costs more than
+            it saves unless many users share their systems, so it is off
+            by default. Only available for a single Kr x Kt*Nt channel
 
     OUTPUT:
-    wSLNRMAX = Kt*Nt x Kr matrix with normalized SLNR-MAX beamforming
+    wSLNRMAX = (... x) Kt*Nt x Kr matrix with normalized SLNR-MAX beamforming
     """
+    h = complex_channel(h, dtype)
+
     # number of users
-    kr = h.shape[0]
+    kr = h.shape[-2]
 
     # total number of antennas
     n = h.shape[-1]
 
     # If eta vector is not provided, all values are set to unity
     if eta is None:
-        eta = np.ones((kr, 1))
-
-    # If d matrix is not provided, all antennas can transmit to everyone
-    if d is None:
-        d = np.tile(np.eye(n), [kr, 1, 1])
+        eta = np.ones(h.shape[:-1])
+    eta = np.asarray(eta)
+    if eta.shape != h.shape[:-1]:
+        if eta.shape not in ((kr,), (kr, 1)):
+            raise ValueError(f"eta must have shape {(kr, 1)}, {(kr,)} or {h.shape[:-1]}, got {eta.shape}")
+        # shared by all leading dimensions of H
+        eta = np.broadcast_to(np.reshape(eta, kr), h.shape[:-1])
 
-    # Pre-allocate an array for SLNR-MAX beamforming
-    w_slnr_max = np.zeros(np.transpose(h.shape), dtype=np.complex128)
+    if group_users and h.ndim != 2:
+        raise ValueError(f"group_users needs a single {kr} x {n} channel, got shape {h.shape}")
 
     # Compute SLNR-MAX, based on Definition 3.5 in optimal resource allocation
-    for k in range(0, kr):
-        effective_channel = np.conj(np.transpose(np.matmul(h, d[k, :, :])))
-        # np.linalg.lstsq is the numpy solution to right division in MATLAB
-        # Compute zero-forcing based on channel inversion
-        # Normalization of zero-forcing direction
-        projected_vector, _, _, _ = np.linalg.lstsq(
-            (
-                np.eye(n) / eta[k]
-                + np.matmul(
-                    effective_channel,
-                    np.conj(
-                        np.transpose(effective_channel),
-                    ),
-                )
-            ),
-            effective_channel[:, k],
-            rcond=-1,
-        )
-        # Normalization of useful channel
-        # use the 2-norm, like in MATLAB
-        w_slnr_max[:, k] = projected_vector / np.linalg.norm(projected_vector, ord=2)
+    # The effective channel of user k is (H*D(:,:,k))' = D(:,:,k)*H', thus
+    # effective_channel*effective_channel' = D(:,:,k)*H'*H*D(:,:,k) and all
+    # users share the Gram matrix H'*H
+    if gram is None:
+        gram = channel_gram(h)
+    else:
+        gram = np.asarray(gram, dtype=h.dtype)
+    antennas = np.arange(n)
+
+    if d is None and np.all(eta == eta[..., :1]):
+        # All antennas can transmit to everyone and eta is the same for every
+        # user, so all users share I/eta + H'*H. A single solve handles every
+        # user at once with the useful channels as right-hand side columns
+        signal_leakage_noise = np.array(gram, order="F")
+        signal_leakage_noise[..., antennas, antennas] += 1 / eta[..., :1]
+        useful_channels = np.conj(np.swapaxes(h, -1, -2))
+        projected_vectors = np.swapaxes(_solve_hermitian(signal_leakage_noise, useful_channels), -1, -2)
+    else:
+        # D(:,:,k) is diagonal, so H*D(:,:,k) only masks the columns of H
+        d_diag = None if d is None else d_to_diag(d, h.shape)
+
+        if group_users:
+            projected_vectors = _solve_grouped_users(h, gram, eta, d_diag)
+        else:
+            signal_leakage_noise = _signal_leakage_noise(gram, eta, d_diag)
+            # Useful channels, row k is column k of the effective channel of user k
+            useful_channels = np.conj(h)
+            if d_diag is not None:
+                useful_channels *= d_diag
+
+            # MATLAB left division for all users in a single batched solve
+            projected_vectors = _solve_hermitian(signal_leakage_noise, useful_channels[..., np.newaxis])[..., 0]
+
+    # Normalization of useful channel
+    # use the 2-norm, like in MATLAB
+    w_slnr_max = normalize_beamforming(projected_vectors)
 
     return w_slnr_max
 
 
+def slnr_max_batched(h: np.ndarray, eta: np.ndarray = None, d: np.ndarray = None, dtype: np.dtype = None):
+    """
+    Calculates the SLNR-MAX beamforming for a batch of channel realizations
+    at once, e.g. in a Monte Carlo evaluation. Equivalent to slnr_max(),
+    which handles the leading batch dimension itself.
+
+    INPUT:
+    H       = B x Kr x Kt*Nt array with the channel matrices of B realizations
+    eta     = (Optional) B x Kr matrix with SNR^(-1) like parameters of every
+            realization, a Kr vector or Kr x 1 column like in slnr_max() is
+            shared by all realizations
+    D       = (Optional) B x Kr x Kt*Nt x Kt*Nt array with the diagonal antenna
+            selection matrices of every realization, or B x Kr x Kt*Nt boolean
+            array with their diagonals, see slnr_max()
+    dtype   = (Optional) complex data type of the computation, complex64 for
+            single precision channels and complex128 otherwise
+
+    OUTPUT:
+    wSLNRMAX = B x Kt*Nt x Kr array with normalized SLNR-MAX beamforming
+    """
+    return slnr_max(h, eta, d, dtype=dtype)
+
+
 def test_slnr_result():
     vector = np.asanyarray(
         [
@@ -1,11 +1,8 @@
 import numpy as np
-import cvxpy
-import logging
+from pyforming._utils import complex_channel, d_to_diag, normalize_beamforming
 
-logger = logging.getLogger("pyforming")
 
-
-def zfbf(h: np.ndarray, d: np.ndarray = None):
+def zfbf(h: np.ndarray, d: np.ndarray = None, dtype: np.dtype = None):
     """
     Calculates the zero-forcing beamforming (ZFBF) vectors for a
     scenario where all or a subset of antennas transmit to each user.
@@ -26,49 +23,41 @@ def zfbf(h: np.ndarray, d: np.ndarray = None):
     H  =    Kr x Kt*Nt matrix with row index for users and column index
             transmit antennas
     D  =    Kt*Nt x Kt*Nt x Kr diagonal matrix. Element (j,j,k) is one if j:th
-            transmit antenna can transmit to user k and zero otherwise
+            transmit antenna can transmit to user k and zero otherwise. A boolean
+            Kr x Kt*Nt matrix with the diagonals of D is accepted as well
+    dtype = (Optional) complex data type of the computation, complex64 for
+            single precision channels and complex128 otherwise
 
     OUTPUT:
     wZFBF = Kt*Nt x Kr matrix with normalized ZFBF
     """
+    h = complex_channel(h, dtype)
+
     # number of users
     kr = h.shape[0]
 
-    # total number of antennas
-    n = h.shape[-1]
-
-    # If d matrix is not provided, all antennas can transmit to everyone
+    # Compute ZFBF for all users at once
+    # The MATLAB right division effective_channel/(effective_channel'*effective_channel)
+    # is the conjugate transpose of the pseudoinverse of the effective channel,
+    # that is the pseudoinverse of H*D(:,:,k), computed for the whole stack of
+    # masked channels in a single call
     if d is None:
-        d = np.tile(np.eye(n), [kr, 1, 1])
-
-    # Pre-allocate an array for SLNR-MAX beamforming
-    wZFBF = np.zeros(np.transpose(h.shape), dtype=np.complex128)
-
-    # Compute SLNR-MAX, based on Definition 3.5 in optimal resource allocation
-    for k in range(0, kr):
-        effective_channel = np.conj(np.transpose(np.matmul(h, d[k, :, :])))
-        # np.linalg.lstsq is the numpy solution to right division in MATLAB
-        # Compute zero-forcing based on channel inversion
-        # Normalization of zero-forcing direction
-        # b/A -> solve a.T x.T = b.T instead
-        channel_inversion, _, _, _ = np.linalg.lstsq(
-            np.matmul(
-                np.conj(
-                    np.transpose(effective_channel),
-                ),
-                effective_channel,
-            ).transpose(),
-            effective_channel.transpose(),
-            rcond=-1,
-        )
-        channel_inversion = channel_inversion.transpose()
-        # Normalization of useful channel
-        # use the 2-norm, like in MATLAB
-        # print(
-        #     f"wZFBF shape: {wZFBF.shape}"
-        #     f"\nresult shape: {(channel_inversion / np.linalg.norm(channel_inversion, ord=2)).shape}"
-        # )
-        wZFBF[:, k] = channel_inversion[:, k] / np.linalg.norm(channel_inversion[:, k], ord=2)
+        # All antennas can transmit to everyone, D(:,:,k) is the identity and
+        # every user sees the unmasked channel H, so a single pseudoinverse
+        # covers all users. pinv(H.') = pinv(H).' has the zero-forcing
+        # direction of user k in row k
+        zf_directions = np.linalg.pinv(np.transpose(h))
+    else:
+        # D(:,:,k) is diagonal, so H*D(:,:,k) only masks the columns of H
+        d_diag = d_to_diag(d, h.shape)
+        channel_inversion = np.linalg.pinv(h * d_diag[:, np.newaxis, :])
+        # Zero-forcing direction of user k is column k of its channel inversion
+        users = np.arange(kr)
+        zf_directions = channel_inversion[users, :, users]
+
+    # Normalization of useful channel
+    # use the 2-norm, like in MATLAB
+    wZFBF = normalize_beamforming(zf_directions)
 
     return wZFBF
 
@@ -1,8 +1,29 @@
 from pyforming import __version__
-from pyforming.mrt import mrt
-from pyforming.slnr_max import slnr_max
+from pyforming.mrt import mrt, mrt_batched
+from pyforming.slnr_max import channel_gram, slnr_max, slnr_max_batched
 from pyforming.zfbf import zfbf
 import numpy as np
+import pytest
+
+
+def random_channel(shape, seed):
+    """Reproducible complex Gaussian channel of the given shape"""
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal(shape) + 1j * rng.standard_normal(shape)
+
+
+def reference_slnr_max(h, eta, d):
+    """Per-user SLNR-MAX following Definition 3.5 literally, used as reference"""
+    kr, n = h.shape
+    w = np.zeros((n, kr), dtype=np.complex128)
+    for k in range(kr):
+        effective_channel = np.conj(np.transpose(np.matmul(h, d[k, :, :])))
+        projected_vector = np.linalg.solve(
+            np.eye(n) / eta[k] + np.matmul(effective_channel, np.conj(np.transpose(effective_channel))),
+            effective_channel[:, k],
+        )
+        w[:, k] = projected_vector / np.linalg.norm(projected_vector)
+    return w
 
 
 def test_version():
@@ -202,4 +223,196 @@ def test_zfbf_result():
             ],
         ]
     )
-    assert np.allclose(zfbf(H), vector)
\ No newline at end of file
+    assert np.allclose(zfbf(H), vector)
+
+
+def test_mrt_antenna_subset():
+    H = random_channel((3, 5), 0)
+    D = np.tile(np.eye(5), [3, 1, 1])
+    D[0, 4, 4] = 0
+    D[2, 0, 0] = 0
+
+    expected = np.zeros((5, 3), dtype=np.complex128)
+    for k in range(3):
+        channel_vector = np.conj(np.matmul(H[k, :], D[k, :, :]))
+        expected[:, k] = channel_vector / np.linalg.norm(channel_vector)
+
+    assert np.allclose(mrt(H, D), expected)
+    assert mrt(H).shape == (5, 3)
+
+
+def test_slnr_antenna_subset():
+    H = random_channel((3, 5), 1)
+    eta = np.asarray([[0.5], [1.0], [2.0]])
+    D = np.tile(np.eye(5), [3, 1, 1])
+    D[1, 3, 3] = 0
+    D[2, 0, 0] = 0
+
+    assert np.allclose(slnr_max(H, eta, D), reference_slnr_max(H, eta, D))
+
+
+def test_zfbf_antenna_subset():
+    H = random_channel((3, 6), 2)
+    D = np.tile(np.eye(6), [3, 1, 1])
+    D[0, 5, 5] = 0
+    D[1, 0, 0] = 0
+
+    w = zfbf(H, D)
+
+    assert w.shape == (6, 3)
+    assert np.allclose(np.linalg.norm(w, axis=0), 1)
+    for k in range(3):
+        # the interference to every other user is nulled
+        received = np.matmul(np.matmul(H, D[k, :, :]), w[:, k])
+        assert np.allclose(np.delete(received, k), 0)
+
+
+def test_slnr_shared_system():
+    H = random_channel((3, 4), 3)
+    eta = np.full((3, 1), 0.7)
+
+    # a single shared solve without D must match the per-user systems with D = I
+    assert np.allclose(slnr_max(H, eta), slnr_max(H, eta, np.tile(np.eye(4), [3, 1, 1])))
+
+
+def test_slnr_reused_gram():
+    H = random_channel((3, 4), 4)
+    gram = channel_gram(H)
+
+    assert np.allclose(gram, np.matmul(np.conj(np.transpose(H)), H))
+    for eta in (np.full((3, 1), 0.5), np.asarray([[0.5], [1.0], [2.0]])):
+        assert np.allclose(slnr_max(H, eta, gram=gram), slnr_max(H, eta))
+    # the cached Gram matrix is left untouched
+    assert np.allclose(gram, channel_gram(H))
+
+
+def test_beamforming_layout():
+    H = random_channel((3, 5), 5)
+    D = np.tile(np.eye(5), [3, 1, 1])
+
+    for w in (mrt(H), mrt(H, D), slnr_max(H), slnr_max(H, d=D), zfbf(H), zfbf(H, D)):
+        # one contiguous column per user
+        assert w.shape == (5, 3)
+        assert w.flags["F_CONTIGUOUS"]
+
+
+def test_single_precision():
+    H = random_channel((3, 5), 6)
+    eta = np.asarray([[0.5], [1.0], [2.0]])
+    D = np.tile(np.eye(5), [3, 1, 1])
+    D[0, 1, 1] = 0
+
+    for beamforming, args in ((mrt, (D,)), (slnr_max, ()), (slnr_max, (eta, D)), (zfbf, ()), (zfbf, (D,))):
+        w = beamforming(H.astype(np.complex64), *args)
+        assert w.dtype == np.complex64
+        assert np.allclose(w, beamforming(H, *args), atol=1e-5)
+        assert beamforming(H, *args, dtype=np.complex64).dtype == np.complex64
+
+
+def test_batched_realizations():
+    H = random_channel((5, 3, 4), 7)
+    eta = np.linspace(0.1, 2.0, 15).reshape(5, 3)
+    D = np.tile(np.eye(4), [5, 3, 1, 1])
+    D[:, 0, 2, 2] = 0
+    D[1, 2, 0, 0] = 0
+
+    w_mrt = mrt_batched(H, D)
+    w_shared = slnr_max_batched(H, np.full(3, 0.5))
+    w_slnr = slnr_max_batched(H, eta, D)
+    for b in range(5):
+        assert np.allclose(w_mrt[b], mrt(H[b], D[b]))
+        assert np.allclose(w_shared[b], slnr_max(H[b], np.full(3, 0.5)))
+        assert np.allclose(w_slnr[b], slnr_max(H[b], eta[b], D[b]))
+        assert w_slnr[b].flags["F_CONTIGUOUS"]
+    assert np.allclose(slnr_max_batched(H)[0], slnr_max(H[0]))
+    assert np.allclose(mrt(H, D), w_mrt)
+
+
+def test_slnr_users_sharing_systems():
+    H = random_channel((4, 5), 8)
+    eta = np.asarray([[0.5], [1.0], [0.5], [0.5]])
+    D = np.tile(np.eye(5), [4, 1, 1])
+    # users 0 and 2 share both the antenna subset and eta, user 3 only eta
+    D[0, 4, 4] = D[2, 4, 4] = 0
+    D[1, 0, 0] = 0
+
+    assert np.allclose(slnr_max(H, eta, D, group_users=True), reference_slnr_max(H, eta, D))
+    assert np.allclose(slnr_max(H, eta, group_users=True), slnr_max(H, eta))
+    # every user has its own system
+    distinct_eta = np.asarray([[0.5], [1.0], [2.0], [4.0]])
+    assert np.allclose(slnr_max(H, distinct_eta, D, group_users=True), slnr_max(H, distinct_eta, D))
+
+
+def test_compact_antenna_selection():
+    H = random_channel((3, 6), 9)
+    eta = np.asarray([[0.5], [1.0], [2.0]])
+    d_diag = np.ones((3, 6), dtype=bool)
+    d_diag[0, 5] = False
+    d_diag[1, 0] = False
+    # dense Kr x N x N form of the same antenna selection
+    D = d_diag[:, :, np.newaxis] * np.eye(6)
+
+    assert np.allclose(mrt(H, d_diag), mrt(H, D))
+    assert np.allclose(slnr_max(H, eta, d_diag), slnr_max(H, eta, D))
+    assert np.allclose(zfbf(H, d_diag), zfbf(H, D))
+    assert np.allclose(mrt_batched(H[np.newaxis], d_diag[np.newaxis]), mrt_batched(H[np.newaxis], D[np.newaxis]))
+
+
+def test_batched_eta_column():
+    # B == Kr, so a Kr x 1 column must not be mistaken for one value per realization
+    H = random_channel((4, 4, 4), 10)
+    eta = np.asarray([[0.5], [1.0], [2.0], [4.0]])
+
+    w = slnr_max_batched(H, eta)
+    for b in range(4):
+        assert np.allclose(w[b], slnr_max(H[b], eta))
+    assert np.allclose(slnr_max_batched(H[:3], eta)[2], slnr_max(H[2], eta))
+
+
+def test_invalid_antenna_selection():
+    H = random_channel((3, 4), 11)
+    D = np.tile(np.eye(4), [3, 1, 1])
+    not_diagonal = D.copy()
+    not_diagonal[0, 0, 1] = 1
+
+    for d in (D * 2, not_diagonal):
+        for beamforming in (mrt, slnr_max, zfbf):
+            with pytest.raises(AssertionError):
+                beamforming(H, d=d)
+
+
+def test_antenna_selection_shape():
+    # B == Kr == N, a shared dense D must not be mistaken for a stack of masks
+    H = random_channel((4, 4, 4), 12)
+    D = np.tile(np.eye(4), [4, 1, 1])
+
+    for beamforming in (mrt_batched, slnr_max_batched):
+        with pytest.raises(ValueError):
+            beamforming(H, d=D)
+    with pytest.raises(ValueError):
+        mrt(H[0], D[:3])
+    # compact masks must be boolean
+    with pytest.raises(ValueError):
+        mrt(H[0], np.ones((4, 4)))
+
+
+def test_batched_singular_system():
+    # the last antenna reaches no user, so I/eta + H'*H is singular for an infinite eta
+    H = random_channel((3, 2, 4), 13)
+    H[:, :, 3] = 0
+    eta = np.full(2, np.inf)
+
+    w = slnr_max_batched(H, eta)
+    assert np.all(np.isfinite(w))
+    for b in range(3):
+        assert np.allclose(w[b], slnr_max(H[b], eta))
+
+
+def test_invalid_eta_shape():
+    H = random_channel((3, 2, 4), 14)
+
+    for eta in (np.ones((1, 2)), np.ones(3), np.ones((3, 2, 1))):
+        with pytest.raises(ValueError):
+            slnr_max(H, eta)
+    with pytest.raises(ValueError):
+        slnr_max(H, group_users=True)